@@ -10,29 +10,66 @@ import argparse
 import select
 import logging
 import errno
+import fcntl
 import threading
 from importlib import import_module
 import time
 
 import signal
+import sys
 from future import standard_library
 # noinspection PyUnresolvedReferences
 from future.builtins import *
 import requests
 
+from .flush_control import (
+    AdaptiveFlushController, DEFAULT_LATENCY_SLO, DEFAULT_MAX_FLUSH_INTERVAL, DEFAULT_MAX_FLUSH_THRESHOLD,
+    DEFAULT_MIN_FLUSH_INTERVAL, DEFAULT_MIN_FLUSH_THRESHOLD
+)
+from .profiling import DEFAULT_PROFILE_DURATION, Profiler
+from .rules import compile_rules
+
 standard_library.install_aliases()
 
 DEFAULT_INPUT_FILENAME = '/var/run/jumper_logging_agent/events'
+DEFAULT_CONFIG_FILENAME = '/etc/jumper_logging_agent/config.json'
 DEFAULT_FLUSH_THRESHOLD = 100
 DEFAULT_FLUSH_PRIORITY = 2
 DEFAULT_FLUSH_INTERVAL = 5.0
 DEFAULT_EVENT_TYPE = 'default'
+DEFAULT_UPLOAD_TIMEOUT = 30.0
+# How often pending events are checked against the flush interval in adaptive mode
+ADAPTIVE_FLUSH_TICK = 0.05
 
 
 def is_fifo(filename):
     return stat.S_ISFIFO(os.stat(filename).st_mode)
 
 
+def read_nonblocking(f, size=4096):
+    """Returns the available data, b'' on end of file or None if there is nothing to read yet."""
+    return read_nonblocking_fd(f.fileno(), size)
+
+
+def read_nonblocking_fd(fd, size=4096):
+    try:
+        return os.read(fd, size)
+    except OSError as e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+            return None
+        raise
+
+
+def select_with_retry(rlist):
+    # Signals (e.g. SIGUSR1 for profiling) interrupt select on Python 2
+    while True:
+        try:
+            return select.select(rlist, (), ())
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+
 def open_fifo_read(filename):
     if not os.path.exists(filename):
         dirname = os.path.dirname(filename)
@@ -75,42 +112,169 @@ class DefaultEventStore(object):
     BASE_URL = 'https://eventsapi.jumper.io/1.0'
     BASE_URL_DEV = 'https://eventsapi-dev.jumper.io/1.0'
 
-    def __init__(self, project_id, write_key, dev_mode=False):
-        base_url = self.BASE_URL_DEV if dev_mode else self.BASE_URL
+    def __init__(
+            self, project_id, write_key, dev_mode=False, session=None, base_url=None, timeout=DEFAULT_UPLOAD_TIMEOUT
+    ):
+        base_url = (base_url or (self.BASE_URL_DEV if dev_mode else self.BASE_URL)).rstrip('/')
         self.url = '%s/projects/%s/events' % (base_url, project_id)
+        self.timeout = timeout
         self.headers = {
             'Content-Type': 'application/json',
             'Authorization': write_key,
         }
+        self.session = session or requests.Session()
 
     def add_events(self, events):
-        response = requests.post(self.url, headers=self.headers, json=events)
+        self.post(self.serialize(events))
+
+    @staticmethod
+    def serialize(events):
+        return json.dumps(events)
+
+    def post(self, data):
+        response = self.session.post(self.url, headers=self.headers, data=data, timeout=self.timeout)
         response.raise_for_status()
 
 
+class Project(object):
+    """Pending events of a single project served by the agent, and the event store they are flushed to."""
+
+    def __init__(
+            self, project_id, event_store, input_filename=None, flush_threshold=DEFAULT_FLUSH_THRESHOLD,
+            flush_controller=None
+    ):
+        self.project_id = project_id
+        self.event_store = event_store
+        self.input_filename = input_filename
+        self.flush_threshold = flush_threshold
+        self.flush_controller = flush_controller
+        self.pending_events = []
+        # When pending events were first seen by the adaptive flush timer
+        self.pending_since = None
+
+    def flush(self, timings=None):
+        events = self.pending_events
+        self.pending_events = []
+        pending_since = self.pending_since
+        self.pending_since = None
+
+        if not events:
+            return
+
+        if self.flush_controller is None:
+            self.upload(events, timings)
+            return
+
+        started = time.time()
+        try:
+            self.upload(events, timings)
+        except Exception:
+            self.flush_controller.record_flush(len(events), time.time() - started, ok=False)
+            raise
+        finished = time.time()
+        self.flush_controller.record_flush(len(events), finished - started, finished - (pending_since or started))
+
+    def upload(self, events, timings=None):
+        if timings is None:
+            self.event_store.add_events(events)
+        elif hasattr(self.event_store, 'serialize'):
+            started = time.time()
+            data = self.event_store.serialize(events)
+            serialized = time.time()
+            timings.add('serialize', serialized - started, len(events))
+            self.event_store.post(data)
+            timings.add('upload', time.time() - serialized, len(events))
+        else:
+            started = time.time()
+            self.event_store.add_events(events)
+            timings.add('upload', time.time() - started, len(events))
+
+
 class Agent(object):
     EVENT_TYPE_PROPERTY = 'type'
+    PROJECT_PROPERTY = 'project'
 
     def __init__(
-            self, input_filename, project_id, write_key, flush_priority=DEFAULT_FLUSH_PRIORITY, flush_threshold=DEFAULT_FLUSH_THRESHOLD,
-            flush_interval=DEFAULT_FLUSH_INTERVAL, event_store=None, default_event_type=DEFAULT_EVENT_TYPE,
-            on_listening=None, dev_mode=False
+            self, input_filename, project_id=None, write_key=None, flush_priority=DEFAULT_FLUSH_PRIORITY,
+            flush_threshold=DEFAULT_FLUSH_THRESHOLD, flush_interval=DEFAULT_FLUSH_INTERVAL, event_store=None,
+            default_event_type=DEFAULT_EVENT_TYPE, on_listening=None, dev_mode=False, projects=None, rules=None,
+            profile_dir=None, base_url=None, adaptive_flush=None
     ):
+        """
+        :param projects: list of project configs (dicts with project_id, write_key and optionally input and
+            flush_threshold), used instead of project_id and write_key to serve several projects. Projects with an
+            input get their own named pipe, the others receive events from input_filename, routed by the event's
+            "project" property (or to the first of them if the property is missing).
+        :param rules: filter and field-projection rules applied to every event after parsing and routing (the
+            "project" property of routed events is already removed), see the rules module.
+        :param profile_dir: directory to write profiles to, defaults to the directory of input_filename.
+        :param base_url: events API URL to use instead of DefaultEventStore.BASE_URL (or BASE_URL_DEV in dev_mode).
+        :param adaptive_flush: keyword arguments for an AdaptiveFlushController per project, which then tunes the
+            project's flush threshold and interval, starting from flush_threshold and flush_interval. None to always
+            use flush_threshold and flush_interval.
+        """
         self.input_filename = input_filename
         self.flush_priority = flush_priority
         self.flush_threshold = flush_threshold
         self.flush_interval = flush_interval
         self.event_count = 0
-        self.pending_events = []
-        self.event_store = event_store or DefaultEventStore(project_id, write_key, dev_mode=dev_mode)
+        self.dropped_event_count = 0
+        self.filter_event = compile_rules(rules)
         self.default_event_type = default_event_type
         self.on_listening = on_listening
-        self.project_id = project_id
+        self.profile_dir = profile_dir or os.path.dirname(os.path.abspath(input_filename))
+        self.profiler = None
+        self.profiler_lock = threading.Lock()
+        self.profile_timer = None
+        # Stage timings of the active profile, None when not profiling so the ingest path only pays for a None check
+        self.timings = None
+        # Set by request_profile_toggle, which writes to the wakeup pipe so the select in start() returns and acts on it
+        self.profile_toggle_requested = False
+        self.wakeup_fds = None
+
+        if projects is None:
+            projects = [{'project_id': project_id, 'write_key': write_key}]
+
+        # A single session lets all projects share the pooled connections to the events API
+        self.session = requests.Session()
+        self.adaptive_flush = adaptive_flush
+        self.projects = []
+        for p in projects:
+            project_flush_threshold = p.get('flush_threshold', flush_threshold)
+            flush_controller = None
+            if adaptive_flush is not None:
+                flush_controller = AdaptiveFlushController(
+                    initial_flush_threshold=project_flush_threshold, initial_flush_interval=flush_interval,
+                    **adaptive_flush
+                )
+                project_flush_threshold = flush_controller.flush_threshold
+
+            self.projects.append(Project(
+                p['project_id'],
+                event_store or DefaultEventStore(
+                    p['project_id'], p['write_key'], dev_mode=dev_mode, session=self.session, base_url=base_url
+                ),
+                input_filename=p.get('input'),
+                flush_threshold=project_flush_threshold,
+                flush_controller=flush_controller
+            ))
+        self.projects_by_id = {p.project_id: p for p in self.projects}
+        self.default_project = next((p for p in self.projects if not p.input_filename), None)
+        self.project_id = self.projects[0].project_id
+
+        # Maps each named pipe to the project it feeds, None meaning events are routed by their project property
+        self.inputs = {input_filename: None}
+        for project in self.projects:
+            if project.input_filename:
+                self.inputs[project.input_filename] = project
 
     def start(self):
-        flush_timer = RecurringTimer(self.flush_interval, self.flush)
+        if self.adaptive_flush is None:
+            flush_timer = RecurringTimer(self.flush_interval, self.flush)
+        else:
+            flush_timer = RecurringTimer(ADAPTIVE_FLUSH_TICK, self.flush_due)
         flush_timer.start()
-        input_file = None
+        input_files = {}
         control_file = None
         should_stop = False
 
@@ -125,48 +289,93 @@ class Agent(object):
 
         while not should_stop:
             try:
-                input_file = open_fifo_read(self.input_filename)
+                for filename, project in self.inputs.items():
+                    input_files[open_fifo_read(filename)] = filename, project
                 control_file = open_fifo_read(self.control_filename)
+                wakeup_fd = self.open_wakeup_pipe()
 
                 if self.on_listening:
                     self.on_listening()
 
                 while True:
-                    select_result, _, _, = select.select((input_file, control_file), (), ())
+                    select_result, _, _, = select_with_retry(list(input_files) + [control_file, wakeup_fd])
+
+                    if wakeup_fd in select_result:
+                        read_nonblocking_fd(wakeup_fd)
+                    if self.profile_toggle_requested:
+                        self.profile_toggle_requested = False
+                        self.handle_control(b'profile toggle')
 
-                    if input_file in select_result:
-                        should_flush = False
+                    for input_file in select_result:
+                        if input_file is control_file or input_file is wakeup_fd:
+                            continue
 
+                        filename, project = input_files[input_file]
+                        projects_to_flush = set()
+                        timings = self.timings
+
+                        if timings is not None:
+                            read_started = time.time()
                         line = readline_with_retry(input_file)
                         if not line:
                             # Empty line after select means that the other side has closed its handle
                             input_file.close()
-                            input_file = open_fifo_read(self.input_filename)
+                            del input_files[input_file]
+                            input_files[open_fifo_read(filename)] = filename, project
                         else:
                             while True:
+                                if timings is not None:
+                                    parse_started = time.time()
+                                    timings.add('read', parse_started - read_started)
                                 try:
                                     event = json.loads(line)
                                 except ValueError as e:
                                     log.warn('Invalid JSON: %s\n%s', line, e)
                                     break
-
-                                log.debug('Pending event: %s', repr(event))
-                                self.pending_events.append(event)
-                                self.event_count += 1
-                                should_flush = should_flush or len(self.pending_events) >= self.flush_threshold or \
-                                    event.get('priority') >= self.flush_priority
-
+                                if timings is not None:
+                                    enqueue_started = time.time()
+                                    timings.add('parse', enqueue_started - parse_started)
+
+                                # Route first, so rules can't remove the project property and misroute the event
+                                target = self.route(event, project)
+                                # Rules may remove, rename or redact the priority, it mustn't change when to flush
+                                priority = event.get('priority')
+                                if target and self.filter_event:
+                                    event = self.filter_event(event)
+                                    if event is None:
+                                        self.dropped_event_count += 1
+                                        target = None
+
+                                if target:
+                                    log.debug('Pending event for %s: %s', target.project_id, repr(event))
+                                    target.pending_events.append(event)
+                                    self.event_count += 1
+                                    if target.flush_controller:
+                                        target.flush_controller.record_arrival()
+                                    if len(target.pending_events) >= target.flush_threshold or \
+                                            priority >= self.flush_priority:
+                                        projects_to_flush.add(target)
+
+                                if timings is not None:
+                                    read_started = time.time()
+                                    timings.add('enqueue', read_started - enqueue_started)
                                 line = readline_with_retry(input_file)
                                 if not line:
                                     break
 
-                            if should_flush:
-                                log.debug('calling flush explicitly')
-                                self.flush()
+                            for target in projects_to_flush:
+                                log.debug('calling flush explicitly for %s', target.project_id)
+                                self.flush_project(target)
 
                     if control_file in select_result:
-                        should_stop = True
-                        break  # self.control_file has input - stop
+                        data = read_nonblocking(control_file)
+                        if data == b'':
+                            # The writer has closed its handle
+                            control_file.close()
+                            control_file = open_fifo_read(self.control_filename)
+                        elif data and not self.handle_control(data):
+                            should_stop = True
+                            break  # got a stop command
 
             except select.error as e:
                 if e.args[0] == errno.EINTR:
@@ -177,21 +386,146 @@ class Agent(object):
                     raise
 
             finally:
+                self.stop_profiling()
                 flush_timer.cancel()
                 flush_timer.join()
-                if input_file:
+                for input_file in input_files:
                     input_file.close()
+                input_files.clear()
                 if control_file:
                     control_file.close()
                 self.cleanup()
                 print('Agent stopped')
 
-    def flush(self):
-        events = self.pending_events
-        self.pending_events = []
+    def route(self, event, input_project=None):
+        """
+        Returns the project to upload event to, or None to drop it, removing the event's project property.
+        input_project is the project owning the input the event was read from, None for the shared input.
+        """
+        project_id = event.pop(self.PROJECT_PROPERTY, None)
+        if input_project:
+            if project_id not in (None, input_project.project_id):
+                log.warn('Dropping event for project %s from the input of project %s', project_id,
+                         input_project.project_id)
+                return None
+            return input_project
+
+        if project_id is None:
+            if not self.default_project:
+                log.warn('Dropping event without a project property, every project has its own input')
+            return self.default_project
+
+        project = self.projects_by_id.get(project_id)
+        if not project:
+            log.warn('Dropping event for unknown project %s', project_id)
+        return project
+
+    def handle_control(self, data):
+        """
+        Runs the commands written to the control pipe, one per line:
+            stop                stop the agent
+            profile [seconds]   profile for the given duration (default: DEFAULT_PROFILE_DURATION)
+            profile stop        stop profiling now
+            profile toggle      start profiling if not profiling, stop otherwise
+            metrics             log the flush threshold and interval of each project (and adaptive flush metrics)
+        Returns False if the agent should stop.
+        """
+        for line in data.decode('utf-8', 'replace').splitlines():
+            words = line.split()
+            if not words:
+                continue
+
+            if words == ['stop']:
+                return False
+            elif words == ['metrics']:
+                self.log_flush_metrics()
+            elif words[0] == 'profile' and len(words) <= 2:
+                argument = words[1] if len(words) == 2 else None
+                if argument == 'stop' or (argument == 'toggle' and self.profiler):
+                    self.stop_profiling()
+                elif argument in (None, 'toggle'):
+                    self.start_profiling()
+                else:
+                    try:
+                        duration = float(argument)
+                    except ValueError:
+                        duration = None
+                    # Rejects nan and inf as well, which would keep the profiler running until 'profile stop'
+                    if duration is not None and 0 < duration < float('inf'):
+                        self.start_profiling(duration)
+                    else:
+                        log.warn('Invalid profile duration, expected a positive number of seconds: %s', argument)
+            else:
+                log.warn('Unknown control command: %s', line)
+
+        return True
+
+    def start_profiling(self, duration=DEFAULT_PROFILE_DURATION):
+        with self.profiler_lock:
+            if self.profiler:
+                log.info('Already profiling')
+                return
+
+            filename = os.path.join(self.profile_dir, 'agent_profile_%s.txt' % (time.strftime('%Y%m%d_%H%M%S'),))
+            self.profiler = Profiler(filename)
+            self.profiler.start()
+            self.timings = self.profiler.timings
+            self.profile_timer = threading.Timer(duration, self.stop_profiling)
+            self.profile_timer.daemon = True
+            self.profile_timer.start()
+            log.info('Profiling for %s seconds', duration)
+
+    def stop_profiling(self):
+        with self.profiler_lock:
+            profiler = self.profiler
+            if not profiler:
+                return
+
+            self.profiler = None
+            self.timings = None
+            self.profile_timer.cancel()
+            try:
+                filename = profiler.stop()
+            except (IOError, OSError) as e:
+                log.warn('Could not write profile: %s', e)
+            else:
+                log.info('Profile written to %s', filename)
 
-        if events:
-            self.event_store.add_events(events)
+    def flush(self):
+        for project in self.projects:
+            self.flush_project(project)
+
+    def flush_due(self):
+        """Flushes projects whose pending events waited their flush interval and lets their controllers adjust."""
+        now = time.time()
+        for project in self.projects:
+            controller = project.flush_controller
+            controller.maybe_adjust(now)
+            project.flush_threshold = controller.flush_threshold
+
+            if not project.pending_events:
+                continue
+            if project.pending_since is None:
+                project.pending_since = now
+            elif now - project.pending_since >= controller.flush_interval:
+                self.flush_project(project)
+
+    def log_flush_metrics(self):
+        for project in self.projects:
+            if project.flush_controller:
+                log.info('Flush metrics of project %s: %s', project.project_id, project.flush_controller.metrics())
+            else:
+                log.info(
+                    'Flush metrics of project %s: %s', project.project_id,
+                    {'flush_threshold': project.flush_threshold, 'flush_interval': self.flush_interval}
+                )
+
+    def flush_project(self, project):
+        try:
+            project.flush(self.timings)
+        except Exception as e:
+            # Keep one project's failing uploads from holding back the others
+            log.warn('Failed flushing events of project %s: %s', project.project_id, e, exc_info=True)
 
     @property
     def control_filename(self):
@@ -200,12 +534,39 @@ class Agent(object):
     def stop(self):
         stop_agent(self.input_filename)
 
+    def request_profile_toggle(self):
+        """
+        Starts profiling if not profiling, stops it otherwise. Only sets a flag and wakes up the agent loop, so unlike
+        send_agent_command it is safe to call from a signal handler.
+        """
+        self.profile_toggle_requested = True
+        wakeup_fds = self.wakeup_fds
+        if wakeup_fds:
+            try:
+                os.write(wakeup_fds[1], b'\0')
+            except OSError:
+                # The pipe is full, so a wakeup is pending anyway
+                pass
+
+    def open_wakeup_pipe(self):
+        """Creates the non-blocking self-pipe written by request_profile_toggle and returns its read end."""
+        if self.wakeup_fds is None:
+            wakeup_fds = os.pipe()
+            for fd in wakeup_fds:
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self.wakeup_fds = wakeup_fds
+        return self.wakeup_fds[0]
+
     def cleanup(self):
         try:
             os.remove(self.control_filename)
         except OSError:
             pass
 
+        wakeup_fds, self.wakeup_fds = self.wakeup_fds, None
+        for fd in wakeup_fds or ():
+            os.close(fd)
+
     def __enter__(self):
         return self.start()
 
@@ -217,11 +578,15 @@ def agent_control_filename(agent_input_filename):
     return agent_input_filename + '.control'
 
 
-def stop_agent(agent_input_filename):
+def send_agent_command(agent_input_filename, command):
     filename = agent_control_filename(agent_input_filename)
-    log.debug('Writing stop to %s', filename)
+    log.debug('Writing %s to %s', command, filename)
     with open(filename, b'wb') as f:
-        f.write(b'stop')
+        f.write(command.encode('utf-8') + b'\n')
+
+
+def stop_agent(agent_input_filename):
+    send_agent_command(agent_input_filename, 'stop')
 
 
 def extract_class(s):
@@ -230,7 +595,73 @@ def extract_class(s):
     return getattr(mod, class_name)
 
 
+class ConfigError(Exception):
+    def __init__(self, message, return_code):
+        super(ConfigError, self).__init__(message)
+        self.return_code = return_code
+
+
+def load_config(config_file):
+    if not os.path.isfile(config_file):
+        raise ConfigError('Config file is missing: {}'.format(config_file), 3)
+
+    with open(config_file) as fd:
+        try:
+            config = json.load(fd)
+        except ValueError:
+            raise ConfigError('Config file must be in JSON format: {}'.format(config_file), 4)
+    if not isinstance(config, dict):
+        raise ConfigError('Config file must contain a JSON object: {}'.format(config_file), 4)
+
+    if 'projects' not in config:
+        config['projects'] = [{key: config[key] for key in ('project_id', 'write_key') if key in config}]
+
+    projects = config['projects']
+    if not isinstance(projects, list) or not projects or not all(isinstance(p, dict) for p in projects):
+        raise ConfigError('Config file must declare a non-empty list of project objects: {}'.format(config_file), 5)
+
+    for project in projects:
+        for key in ('project_id', 'write_key'):
+            if key not in project:
+                raise ConfigError('Missing entry in config file: {}. {}'.format(config_file, repr(key)), 5)
+
+    try:
+        compile_rules(config.get('rules'))
+    except ValueError as e:
+        raise ConfigError('Invalid rules in config file: {}. {}'.format(config_file, e), 6)
+
+    return config
+
+
+def add_common_arguments(parser):
+    parser.add_argument('--event-store', help='Module to use as event store', type=str, default=None)
+    parser.add_argument(
+        '--config-file',
+        help='Location of config file in JSON format.',
+        type=str,
+        default=DEFAULT_CONFIG_FILENAME
+    )
+    parser.add_argument('-v', '--verbose', help='Print logs', action='store_true')
+    parser.add_argument('-d', '--dev-mode', help='Sends data to development BE', action='store_true')
+    parser.add_argument(
+        '--base-url', help='Events API URL overriding the production and development BE, e.g. for testing', type=str,
+        default=None
+    )
+
+
+def setup_logging(verbose):
+    log_level = logging.DEBUG if verbose else logging.INFO
+    logging.basicConfig(format='%(asctime)s %(levelname)8s %(name)10s: %(message)s', level=log_level)
+
+
 def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    if args and args[0] == 'backfill':
+        from .backfill import main as backfill_main
+        return backfill_main(args[1:])
+
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', help='Named pipe to read from', type=str, default=DEFAULT_INPUT_FILENAME)
     parser.add_argument(
@@ -248,15 +679,35 @@ def main(args=None):
         '--default-event-type', help='Default event type if not specified in the event itself', type=str,
         default=DEFAULT_EVENT_TYPE
     )
-    parser.add_argument('--event-store', help='Module to use as event store', type=str, default=None)
     parser.add_argument(
-        '--config-file',
-        help='Location of config file in JSON format.',
-        type=str,
-        default='/etc/jumper_logging_agent/config.json'
+        '--adaptive-flush', help='Continuously tune the flush threshold and interval within the bounds below, '
+                                 'starting from --flush-threshold and --flush-interval', action='store_true'
     )
-    parser.add_argument('-v', '--verbose', help='Print logs', action='store_true')
-    parser.add_argument('-d', '--dev-mode', help='Sends data to development BE', action='store_true')
+    parser.add_argument(
+        '--min-flush-threshold', help='Adaptive flush: minimum flush threshold', type=int,
+        default=DEFAULT_MIN_FLUSH_THRESHOLD
+    )
+    parser.add_argument(
+        '--max-flush-threshold', help='Adaptive flush: maximum flush threshold', type=int,
+        default=DEFAULT_MAX_FLUSH_THRESHOLD
+    )
+    parser.add_argument(
+        '--min-flush-interval', help='Adaptive flush: minimum flush interval in seconds', type=float,
+        default=DEFAULT_MIN_FLUSH_INTERVAL
+    )
+    parser.add_argument(
+        '--max-flush-interval', help='Adaptive flush: maximum flush interval in seconds', type=float,
+        default=DEFAULT_MAX_FLUSH_INTERVAL
+    )
+    parser.add_argument(
+        '--latency-slo', help='Adaptive flush: target p99 delay in seconds from reading an event until it is uploaded',
+        type=float, default=DEFAULT_LATENCY_SLO
+    )
+    parser.add_argument(
+        '--profile-dir', help='Directory to write profiles to (default: the directory of the named pipe)', type=str,
+        default=None
+    )
+    add_common_arguments(parser)
     args = parser.parse_args(args=args)
 
     event_store = None
@@ -268,46 +719,53 @@ def main(args=None):
             print('Could not load or instantiate event store %s: %s' % (args.event_store, e))
             return 2
 
-    log_level = logging.DEBUG if args.verbose else logging.INFO
-    logging.basicConfig(format='%(asctime)s %(levelname)8s %(name)10s: %(message)s', level=log_level)
-
-    if not os.path.isfile(args.config_file):
-        print('Config file is missing: {}'.format(args.config_file))
-        return 3
+    setup_logging(args.verbose)
 
-    with open(args.config_file) as fd:
-        try:
-            config = json.load(fd)
-        except ValueError:
-            print('Config file must be in JSON format: {}'.format(args.config_file))
-            return 4
     try:
-        project_id = config['project_id']
-        write_key = config['write_key']
-    except KeyError as e:
-        print('Missing entry in config file: {}. {}'.format(args.config_file, e))
-        return 5
+        config = load_config(args.config_file)
+    except ConfigError as e:
+        print(e)
+        return e.return_code
+
+    adaptive_flush = None
+    if args.adaptive_flush:
+        adaptive_flush = dict(
+            min_flush_threshold=args.min_flush_threshold,
+            max_flush_threshold=args.max_flush_threshold,
+            min_flush_interval=args.min_flush_interval,
+            max_flush_interval=args.max_flush_interval,
+            latency_slo=args.latency_slo
+        )
 
     print('Starting agent')
 
     def on_listening():
         print('Agent listening on named pipe %s' % (agent.input_filename,))
 
-    agent = Agent(
-        input_filename=args.input,
-        project_id=project_id,
-        write_key=write_key,
-        flush_priority=args.flush_priority,
-        flush_threshold=args.flush_threshold,
-        flush_interval=args.flush_interval,
-        default_event_type=args.default_event_type,
-        event_store=event_store,
-        on_listening=on_listening,
-        dev_mode=args.dev_mode
-    )
+    try:
+        agent = Agent(
+            input_filename=args.input,
+            projects=config['projects'],
+            rules=config.get('rules'),
+            flush_priority=args.flush_priority,
+            flush_threshold=args.flush_threshold,
+            flush_interval=args.flush_interval,
+            default_event_type=args.default_event_type,
+            event_store=event_store,
+            on_listening=on_listening,
+            dev_mode=args.dev_mode,
+            profile_dir=args.profile_dir,
+            base_url=args.base_url,
+            adaptive_flush=adaptive_flush
+        )
+    except ValueError as e:
+        print('Invalid flush parameters: %s' % (e,))
+        return 2
 
     signal.signal(signal.SIGTERM, lambda *a: agent.stop())
     signal.signal(signal.SIGINT, lambda *a: agent.stop())
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda *a: agent.request_profile_toggle())
 
     atexit.register(agent.cleanup)
 
@@ -0,0 +1,404 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from queue import Queue
+
+import requests
+from future import standard_library
+# noinspection PyUnresolvedReferences
+from future.builtins import *
+
+from .agent import DefaultEventStore, ConfigError, add_common_arguments, extract_class, load_config, setup_logging
+from .rules import compile_rules
+
+standard_library.install_aliases()
+
+DEFAULT_CHECKPOINT_FILENAME = '/var/lib/jumper_logging_agent/backfill_checkpoint.json'
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_BYTES = 512 * 1024
+DEFAULT_RATE_LIMIT = 0.0
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_DELAY = 1.0
+
+log = logging.getLogger('jumper.Backfill')
+
+
+class BatchRejected(Exception):
+    """Raised when the events API refuses a batch for good, e.g. with 400 Bad Request or 413 Payload Too Large."""
+
+
+def error_status_code(error):
+    """Returns the HTTP status code of a failed upload's response, or None if there was no response."""
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def retry_after(error):
+    """Returns the delay in seconds requested by the Retry-After header of a failed upload's response, or 0."""
+    try:
+        return max(0.0, float(error.response.headers['Retry-After']))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        # No response, no header, or an HTTP date, which the events API doesn't send
+        return 0.0
+
+
+def read_batches(
+        filename, start_offset=0, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=DEFAULT_BATCH_BYTES, filter_event=None
+):
+    """
+    Streams an NDJSON file (optionally gzipped) from start_offset and yields (events, end_offset) tuples.
+    A batch is cut when it holds batch_size events or batch_bytes bytes of raw JSON, whichever comes first.
+    end_offset is the (uncompressed) file offset right after the last line of the batch.
+    filter_event, if given, is applied to every event as returned by rules.compile_rules.
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rb') as f:
+        if start_offset:
+            f.seek(start_offset)
+
+        offset = start_offset
+        events = []
+        size = 0
+        for line in f:
+            offset += len(line)
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                event = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                log.warn('Invalid JSON in %s: %s\n%s', filename, line, e)
+                continue
+
+            if filter_event:
+                event = filter_event(event)
+                if event is None:
+                    continue
+
+            events.append(event)
+            size += len(line)
+            if len(events) >= batch_size or size >= batch_bytes:
+                yield events, offset
+                events = []
+                size = 0
+
+        if events:
+            yield events, offset
+
+
+class RateLimiter(object):
+    """Token bucket allowing `rate` acquisitions per second across threads. A rate of 0 disables limiting."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 1.0
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(1.0, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint(object):
+    """
+    Per-file upload progress. Batches may complete out of order, so a file's offset only advances over the
+    contiguous prefix of uploaded batches, and never past a batch that failed.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.files = {}
+        self._next_seq = {}
+        self._done = {}
+        self._last_seq = {}
+        self._failed = set()
+        if filename and os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                self.files = json.loads(f.read().decode('utf-8')).get('files', {})
+
+    def offset(self, path):
+        return self.files.get(path, {}).get('offset', 0)
+
+    def is_complete(self, path):
+        return self.files.get(path, {}).get('complete', False)
+
+    def has_failed(self, path):
+        return path in self._failed
+
+    def batch_done(self, path, seq, end_offset):
+        with self.lock:
+            self._done.setdefault(path, {})[seq] = end_offset
+            self._advance(path)
+
+    def batch_failed(self, path, seq):
+        with self.lock:
+            self._failed.add(path)
+
+    def file_read(self, path, num_batches):
+        with self.lock:
+            self._last_seq[path] = num_batches
+            self._advance(path)
+
+    def _advance(self, path):
+        entry = self.files.setdefault(path, {'offset': 0, 'complete': False})
+        done = self._done.get(path, {})
+        seq = self._next_seq.get(path, 0)
+        while seq in done:
+            entry['offset'] = done.pop(seq)
+            seq += 1
+        self._next_seq[path] = seq
+
+        if self._last_seq.get(path) == seq:
+            entry['complete'] = True
+            log.info('Finished uploading %s', path)
+        self.save()
+
+    def save(self):
+        """Writes the checkpoint file, raising IOError or OSError if it can't be written."""
+        if not self.filename:
+            return
+
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(json.dumps({'files': self.files}, sort_keys=True).encode('utf-8'))
+        os.rename(tmp_filename, self.filename)
+
+
+class Backfill(object):
+    def __init__(
+            self, event_store, checkpoint=None, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+            batch_bytes=DEFAULT_BATCH_BYTES, rate_limit=DEFAULT_RATE_LIMIT, max_retries=DEFAULT_MAX_RETRIES,
+            retry_delay=DEFAULT_RETRY_DELAY, rules=None, quarantine_filename=None
+    ):
+        """
+        :param quarantine_filename: NDJSON file to append batches rejected by the events API to, so that the backfill
+            can move past them. None to leave their files incomplete instead.
+        """
+        self.event_store = event_store
+        self.checkpoint = checkpoint or Checkpoint()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.filter_event = compile_rules(rules)
+        self.quarantine_filename = quarantine_filename
+        self.event_count = 0
+        self.quarantined_event_count = 0
+        self._count_lock = threading.Lock()
+        self._quarantine_lock = threading.Lock()
+
+    def run(self, filenames):
+        """Uploads all files and returns True if every one of them was fully uploaded."""
+        batches = Queue(maxsize=self.workers * 2)
+        threads = [threading.Thread(target=self._worker, args=(batches,)) for _ in range(self.workers)]
+        for i, t in enumerate(threads):
+            t.name = 'backfill-%s' % i
+            t.daemon = True
+            t.start()
+
+        paths = [os.path.abspath(filename) for filename in filenames]
+        try:
+            for path in paths:
+                self._read_file(path, batches)
+        finally:
+            for _ in threads:
+                batches.put(None)
+            for t in threads:
+                t.join()
+
+        return all(self.checkpoint.is_complete(path) for path in paths)
+
+    def _read_file(self, path, batches):
+        if self.checkpoint.is_complete(path):
+            log.info('Skipping %s, already uploaded', path)
+            return
+
+        start_offset = self.checkpoint.offset(path)
+        log.info('Uploading %s from offset %s', path, start_offset)
+        seq = 0
+        try:
+            for events, end_offset in read_batches(
+                    path, start_offset, self.batch_size, self.batch_bytes, self.filter_event
+            ):
+                if self.checkpoint.has_failed(path):
+                    log.warn('Giving up on the rest of %s', path)
+                    return
+                batches.put((path, seq, events, end_offset))
+                seq += 1
+        except (IOError, OSError) as e:
+            # The file stays incomplete in the checkpoint, the remaining files are still uploaded
+            log.warn('Could not read %s: %s', path, e)
+            return
+        self.checkpoint.file_read(path, seq)
+
+    def _worker(self, batches):
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+
+            path, seq, events, end_offset = item
+            try:
+                if self._upload(events):
+                    with self._count_lock:
+                        self.event_count += len(events)
+                    self.checkpoint.batch_done(path, seq, end_offset)
+                else:
+                    self.checkpoint.batch_failed(path, seq)
+            except BatchRejected as e:
+                if self.quarantine_filename:
+                    self._quarantine(events)
+                    log.warn('Batch %s of %s was rejected, quarantined it to %s: %s', seq, path,
+                             self.quarantine_filename, e)
+                    self.checkpoint.batch_done(path, seq, end_offset)
+                else:
+                    log.warn('Batch %s of %s was rejected: %s', seq, path, e)
+                    self.checkpoint.batch_failed(path, seq)
+            except Exception as e:
+                # Keep the worker alive, otherwise the reader blocks forever on the full queue
+                log.warn('Failed processing batch %s of %s: %s', seq, path, e, exc_info=True)
+                self.checkpoint.batch_failed(path, seq)
+
+    def _upload(self, events):
+        """Returns True once uploaded, False if all retries failed, raises BatchRejected if retrying can't help."""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                self.event_store.add_events(events)
+                return True
+            except Exception as e:
+                status_code = error_status_code(e)
+                if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+                    raise BatchRejected(str(e))
+                log.warn('Failed uploading %s events (attempt %s): %s', len(events), attempt + 1, e)
+                if attempt < self.max_retries:
+                    time.sleep(max(self.retry_delay * 2 ** attempt, retry_after(e)))
+        return False
+
+    def _quarantine(self, events):
+        with self._quarantine_lock:
+            with open(self.quarantine_filename, 'ab') as f:
+                for event in events:
+                    f.write(json.dumps(event).encode('utf-8') + b'\n')
+            self.quarantined_event_count += len(events)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='jumper-logging-agent backfill')
+    parser.add_argument('files', help='NDJSON event files to upload (.gz files are decompressed)', nargs='+')
+    parser.add_argument(
+        '--workers', help='Number of concurrent upload workers', type=int, default=DEFAULT_WORKERS
+    )
+    parser.add_argument(
+        '--batch-size', help='Maximum number of events per upload', type=int, default=DEFAULT_BATCH_SIZE
+    )
+    parser.add_argument(
+        '--batch-bytes', help='Maximum size in bytes of raw event JSON per upload', type=int,
+        default=DEFAULT_BATCH_BYTES
+    )
+    parser.add_argument(
+        '--rate-limit', help='Maximum number of uploads per second across all workers (0 for unlimited)',
+        type=float, default=DEFAULT_RATE_LIMIT
+    )
+    parser.add_argument(
+        '--max-retries', help='Number of times a failed upload is retried', type=int, default=DEFAULT_MAX_RETRIES
+    )
+    parser.add_argument(
+        '--checkpoint-file', help='Location of the progress file used to resume an interrupted backfill', type=str,
+        default=DEFAULT_CHECKPOINT_FILENAME
+    )
+    parser.add_argument(
+        '--quarantine-file', help='File to append batches the events API rejects (4xx other than 429) to, so that '
+        'the backfill can complete without them (default: leave their files incomplete)', type=str, default=None
+    )
+    parser.add_argument(
+        '--project-id', help='Project to upload to, when the config file declares several (default: the first)',
+        type=str, default=None
+    )
+    add_common_arguments(parser)
+    args = parser.parse_args(args=args)
+
+    setup_logging(args.verbose)
+
+    try:
+        config = load_config(args.config_file)
+    except ConfigError as e:
+        print(e)
+        return e.return_code
+
+    projects = [p for p in config['projects'] if args.project_id in (None, p['project_id'])]
+    if not projects:
+        print('Project %s is not in config file: %s' % (args.project_id, args.config_file))
+        return 5
+    project = projects[0]
+
+    if args.event_store:
+        try:
+            event_store = extract_class(args.event_store)()
+        except Exception as e:
+            print('Could not load or instantiate event store %s: %s' % (args.event_store, e))
+            return 2
+    else:
+        # Every worker keeps a connection open, more than requests pools per host by default
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        event_store = DefaultEventStore(
+            project['project_id'], project['write_key'], dev_mode=args.dev_mode, session=session,
+            base_url=args.base_url
+        )
+
+    try:
+        checkpoint = Checkpoint(args.checkpoint_file)
+        checkpoint.save()
+    except (IOError, OSError, ValueError) as e:
+        print('Could not use checkpoint file %s: %s' % (args.checkpoint_file, e))
+        return 7
+
+    backfill = Backfill(
+        event_store,
+        checkpoint=checkpoint,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        batch_bytes=args.batch_bytes,
+        rate_limit=args.rate_limit,
+        max_retries=args.max_retries,
+        rules=config.get('rules'),
+        quarantine_filename=args.quarantine_file,
+    )
+
+    start_time = time.time()
+    success = backfill.run(args.files)
+    print('Uploaded %s events in %.1f seconds' % (backfill.event_count, time.time() - start_time))
+    if backfill.quarantined_event_count:
+        print('Quarantined %s rejected events to %s' % (backfill.quarantined_event_count, args.quarantine_file))
+    if not success:
+        print('Some files were not fully uploaded, run again to resume')
+        return 1
+    return 0
@@ -0,0 +1,300 @@
+"""
+A local stand-in for the events API with fault injection, for soak and load testing the agent's real upload path:
+
+    python -m jumper_logging_agent.fake_events_api --port 8080 --latency exp:0.2 --throttle-rate 0.05
+    jumper-logging-agent --base-url http://127.0.0.1:8080/1.0 ...
+
+GET /stats returns the counters collected so far.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import collections
+import json
+import logging
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from future import standard_library
+# noinspection PyUnresolvedReferences
+from future.builtins import *
+
+standard_library.install_aliases()
+
+DEFAULT_PORT = 8080
+DEFAULT_SLOW_READ_DELAY = 0.5
+SLOW_READ_CHUNK_SIZE = 1024
+RETRY_AFTER_SECONDS = 1
+
+# Faults are drawn in this order, each with its own probability
+FAULTS = ('reset', 'throttle', 'unavailable', 'error', 'slow_read')
+
+log = logging.getLogger('jumper.FakeEventsAPI')
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution into a function that draws a delay in seconds from a random.Random. Accepts a
+    constant ("0.05"), "uniform:LOW,HIGH", "exp:MEAN", "normal:MEAN,STDDEV" or "lognormal:MU,SIGMA". Raises ValueError
+    for specs that could draw a negative delay or fail to draw at all (e.g. "exp:0").
+    """
+    if not spec:
+        return lambda rng: 0.0
+
+    name, _, params = spec.partition(':')
+    try:
+        if not params:
+            delay = float(name)
+            if delay >= 0:
+                return lambda rng: delay
+        else:
+            values = [float(v) for v in params.split(',')]
+            if name == 'uniform':
+                low, high = values
+                if 0 <= low <= high:
+                    return lambda rng: rng.uniform(low, high)
+            elif name == 'exp':
+                mean, = values
+                if mean > 0:
+                    return lambda rng: rng.expovariate(1.0 / mean)
+            elif name == 'normal':
+                mean, stddev = values
+                if stddev >= 0:
+                    return lambda rng: max(0.0, rng.normalvariate(mean, stddev))
+            elif name == 'lognormal':
+                mu, sigma = values
+                if sigma >= 0:
+                    return lambda rng: rng.lognormvariate(mu, sigma)
+    except ValueError:
+        pass
+
+    raise ValueError('Invalid latency distribution: %s' % (spec,))
+
+
+class FakeEventsAPIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive, so the agent's connection pooling is exercised as well
+    protocol_version = 'HTTP/1.1'
+    EVENTS_PATH = re.compile(r'^/1\.0/projects/([^/]+)/events$')
+
+    def do_POST(self):
+        match = self.EVENTS_PATH.match(self.path)
+        if not match:
+            self.read_body()
+            return self.respond(404, {'error': 'Not found'})
+
+        fault = self.server.draw_fault()
+        if fault == 'reset':
+            return self.reset_connection()
+
+        time.sleep(self.server.draw_latency())
+        body = self.read_body(slow=fault == 'slow_read')
+
+        if fault == 'throttle':
+            return self.respond(429, {'error': 'Too many requests'}, {'Retry-After': str(RETRY_AFTER_SECONDS)})
+        elif fault == 'unavailable':
+            return self.respond(503, {'error': 'Service unavailable'}, {'Retry-After': str(RETRY_AFTER_SECONDS)})
+        elif fault == 'error':
+            return self.respond(500, {'error': 'Internal server error'})
+
+        if not self.headers.get('Authorization'):
+            return self.respond(401, {'error': 'Missing write key'})
+
+        try:
+            events = json.loads(body.decode('utf-8'))
+        except ValueError:
+            events = None
+        if not isinstance(events, list):
+            return self.respond(400, {'error': 'Body must be a JSON array of events'})
+
+        self.server.record_events(match.group(1), events)
+        self.respond(200, {'created': len(events)})
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.respond(200, self.server.stats())
+        else:
+            self.respond(404, {'error': 'Not found'})
+
+    def read_body(self, slow=False):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not slow:
+            return self.rfile.read(length)
+
+        chunks = []
+        while length > 0:
+            time.sleep(self.server.slow_read_delay)
+            chunk = self.rfile.read(min(length, SLOW_READ_CHUNK_SIZE))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b''.join(chunks)
+
+    def respond(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.server.record_response(status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def reset_connection(self):
+        # Closing with a zero linger timeout, and the request body still unread, makes the kernel send a RST
+        self.server.record_response('reset')
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack(b'ii', 1, 0))
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class FakeEventsAPI(ThreadingMixIn, HTTPServer):
+    """
+    Serves POST /1.0/projects/<project_id>/events like the events API, failing requests at random with the given rates
+    (probabilities between 0 and 1, adding up to at most 1) after an artificial latency drawn from `latency` (see
+    parse_latency). Raises ValueError for invalid rates or latency.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    # socketserver's default backlog of 5 refuses connections under load, faults nobody asked for
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(
+            self, address=('127.0.0.1', DEFAULT_PORT), latency=None, reset_rate=0.0, throttle_rate=0.0,
+            unavailable_rate=0.0, error_rate=0.0, slow_read_rate=0.0, slow_read_delay=DEFAULT_SLOW_READ_DELAY,
+            seed=None
+    ):
+        # Validated before binding, so invalid arguments don't leave a listening socket behind
+        self.draw_delay = parse_latency(latency)
+        self.fault_rates = dict(
+            reset=reset_rate, throttle=throttle_rate, unavailable=unavailable_rate, error=error_rate,
+            slow_read=slow_read_rate
+        )
+        for fault, rate in self.fault_rates.items():
+            if not 0 <= rate <= 1:
+                raise ValueError('%s rate must be between 0 and 1: %s' % (fault, rate))
+        # Allow for rounding, e.g. rates given as 0.1 steps adding up to exactly 1
+        if sum(self.fault_rates.values()) > 1 + 1e-9:
+            raise ValueError('Fault rates must add up to at most 1: %s' % (sum(self.fault_rates.values()),))
+        if slow_read_delay < 0:
+            raise ValueError('Slow read delay must not be negative: %s' % (slow_read_delay,))
+
+        # The socketserver classes are old-style classes on Python 2
+        HTTPServer.__init__(self, address, FakeEventsAPIHandler)
+        self.slow_read_delay = slow_read_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.event_counts = collections.Counter()
+        self.response_counts = collections.Counter()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%s/1.0' % (host, port)
+
+    def draw_fault(self):
+        with self.lock:
+            r = self.random.random()
+        for fault in FAULTS:
+            r -= self.fault_rates[fault]
+            if r < 0:
+                return fault
+        return None
+
+    def draw_latency(self):
+        with self.lock:
+            return self.draw_delay(self.random)
+
+    def record_events(self, project_id, events):
+        with self.lock:
+            self.event_counts[project_id] += len(events)
+
+    def record_response(self, status):
+        with self.lock:
+            self.response_counts[str(status)] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'events': dict(self.event_counts),
+                'total_events': sum(self.event_counts.values()),
+                'responses': dict(self.response_counts),
+                'total_requests': sum(self.response_counts.values()),
+            }
+
+    def start(self):
+        """Serves in a background thread and returns self, for use in tests."""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.name = 'fake-events-api'
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread:
+            self.thread.join()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m jumper_logging_agent.fake_events_api')
+    parser.add_argument('--host', help='Address to listen on', type=str, default='127.0.0.1')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        '--latency', help='Response latency distribution in seconds, e.g. 0.05, uniform:0.01,0.5, exp:0.1, '
+                          'normal:0.1,0.05 or lognormal:-2,0.5', type=str, default=None
+    )
+    parser.add_argument('--reset-rate', help='Fraction of connections reset', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', help='Fraction of requests answered with 429', type=float, default=0.0)
+    parser.add_argument('--unavailable-rate', help='Fraction of requests answered with 503', type=float, default=0.0)
+    parser.add_argument('--error-rate', help='Fraction of requests answered with 500', type=float, default=0.0)
+    parser.add_argument('--slow-read-rate', help='Fraction of request bodies read slowly', type=float, default=0.0)
+    parser.add_argument(
+        '--slow-read-delay', help='Delay in seconds per %s bytes of slowly read bodies' % (SLOW_READ_CHUNK_SIZE,),
+        type=float, default=DEFAULT_SLOW_READ_DELAY
+    )
+    parser.add_argument('--seed', help='Random seed, for reproducible runs', type=int, default=None)
+    parser.add_argument('-v', '--verbose', help='Log every request', action='store_true')
+    args = parser.parse_args(args=args)
+
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)8s %(name)10s: %(message)s',
+        level=logging.DEBUG if args.verbose else logging.INFO
+    )
+
+    try:
+        server = FakeEventsAPI(
+            (args.host, args.port), latency=args.latency, reset_rate=args.reset_rate,
+            throttle_rate=args.throttle_rate, unavailable_rate=args.unavailable_rate, error_rate=args.error_rate,
+            slow_read_rate=args.slow_read_rate, slow_read_delay=args.slow_read_delay, seed=args.seed
+        )
+    except ValueError as e:
+        print(e)
+        return 2
+
+    print('Fake events API listening on %s' % (server.base_url,))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats(), sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,164 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import collections
+import logging
+import threading
+import time
+
+from future import standard_library
+# noinspection PyUnresolvedReferences
+from future.builtins import *
+
+standard_library.install_aliases()
+
+DEFAULT_MIN_FLUSH_THRESHOLD = 10
+DEFAULT_MAX_FLUSH_THRESHOLD = 1000
+DEFAULT_MIN_FLUSH_INTERVAL = 0.1
+DEFAULT_MAX_FLUSH_INTERVAL = 30.0
+DEFAULT_LATENCY_SLO = 10.0
+DEFAULT_ADJUST_INTERVAL = 5.0
+
+# Fraction of the latency SLO targeted, leaving room for variance the window has not seen yet
+SLO_HEADROOM = 0.8
+# Fraction of failed uploads above which the backend is considered degraded
+ERROR_RATE_THRESHOLD = 0.1
+MIN_SLO_CORRECTION = 0.05
+ARRIVAL_RATE_SMOOTHING = 0.5
+WINDOW_SIZE = 200
+
+log = logging.getLogger('jumper.FlushController')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+class AdaptiveFlushController(object):
+    """
+    Chooses a project's flush threshold (batch size) and flush interval (how long events may linger before being
+    flushed) from the measured event arrival rate, upload latency and upload errors.
+
+    Batches are made as large as possible while keeping the p99 delivery latency (time from the first event of a batch
+    being seen until its upload completes) within latency_slo: the flush interval is the SLO minus the p99 upload
+    latency, tightened while the measured delivery latency misses the SLO, and the flush threshold is the number of
+    events expected to arrive (as reported by record_arrival) during that interval. Both values always stay within the
+    given bounds.
+
+    Only successful uploads are measured, and while more than ERROR_RATE_THRESHOLD of the uploads fail, the threshold
+    and interval are never lowered: smaller batches would only send more requests to the degraded backend, each of
+    them as likely to time out. Failed batches are dropped rather than retried, so the interval isn't lengthened either,
+    which would only put more events at risk.
+    """
+
+    def __init__(
+            self, min_flush_threshold=DEFAULT_MIN_FLUSH_THRESHOLD, max_flush_threshold=DEFAULT_MAX_FLUSH_THRESHOLD,
+            min_flush_interval=DEFAULT_MIN_FLUSH_INTERVAL, max_flush_interval=DEFAULT_MAX_FLUSH_INTERVAL,
+            latency_slo=DEFAULT_LATENCY_SLO, adjust_interval=DEFAULT_ADJUST_INTERVAL, initial_flush_threshold=None,
+            initial_flush_interval=None
+    ):
+        if min_flush_threshold > max_flush_threshold or min_flush_interval > max_flush_interval:
+            raise ValueError('Minimum flush threshold and interval must not exceed their maximum')
+
+        self.min_flush_threshold = min_flush_threshold
+        self.max_flush_threshold = max_flush_threshold
+        self.min_flush_interval = min_flush_interval
+        self.max_flush_interval = max_flush_interval
+        self.latency_slo = latency_slo
+        self.adjust_interval = adjust_interval
+
+        self.flush_threshold = int(clamp(
+            initial_flush_threshold or min_flush_threshold, min_flush_threshold, max_flush_threshold
+        ))
+        self.flush_interval = clamp(
+            initial_flush_interval or latency_slo * SLO_HEADROOM, min_flush_interval, max_flush_interval
+        )
+
+        self.lock = threading.Lock()
+        self.upload_latencies = collections.deque(maxlen=WINDOW_SIZE)
+        self.delivery_latencies = collections.deque(maxlen=WINDOW_SIZE)
+        self.arrival_rate = None
+        self.error_rate = 0.0
+        self.slo_correction = 1.0
+        self.last_adjust_time = time.time()
+        self.window_arrivals = 0
+        self.window_uploads = 0
+        self.window_errors = 0
+
+    def record_arrival(self, num_events=1):
+        """Records events as they are enqueued, the arrival rate is measured from these rather than from flushes."""
+        with self.lock:
+            self.window_arrivals += num_events
+
+    def record_flush(self, num_events, upload_seconds, delivery_latency=None, ok=True):
+        """Records an upload of num_events. delivery_latency is None for failed uploads."""
+        with self.lock:
+            self.window_uploads += 1
+            if ok:
+                self.upload_latencies.append(upload_seconds)
+                self.delivery_latencies.append(delivery_latency)
+            else:
+                self.window_errors += 1
+
+    def maybe_adjust(self, now=None):
+        now = time.time() if now is None else now
+        if now - self.last_adjust_time >= self.adjust_interval:
+            self.adjust(now)
+
+    def adjust(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            elapsed = now - self.last_adjust_time
+            if elapsed <= 0:
+                return
+
+            rate = self.window_arrivals / elapsed
+            if self.arrival_rate is None:
+                self.arrival_rate = rate
+            else:
+                self.arrival_rate += ARRIVAL_RATE_SMOOTHING * (rate - self.arrival_rate)
+
+            self.error_rate = self.window_errors / self.window_uploads if self.window_uploads else 0.0
+
+            delivery_p99 = percentile(self.delivery_latencies, 0.99)
+            if delivery_p99 is not None and delivery_p99 > self.latency_slo:
+                self.slo_correction = max(
+                    MIN_SLO_CORRECTION, self.slo_correction * max(0.5, self.latency_slo / delivery_p99)
+                )
+            elif delivery_p99 is not None and delivery_p99 < self.latency_slo * SLO_HEADROOM:
+                self.slo_correction = min(1.0, self.slo_correction * 1.1)
+
+            upload_p99 = percentile(self.upload_latencies, 0.99) or 0.0
+            linger = max(0.0, self.latency_slo * SLO_HEADROOM - upload_p99) * self.slo_correction
+            flush_interval = clamp(linger, self.min_flush_interval, self.max_flush_interval)
+            flush_threshold = int(clamp(
+                round(self.arrival_rate * flush_interval), self.min_flush_threshold, self.max_flush_threshold
+            ))
+            if self.error_rate > ERROR_RATE_THRESHOLD:
+                flush_interval = max(flush_interval, self.flush_interval)
+                flush_threshold = max(flush_threshold, self.flush_threshold)
+            self.flush_interval = flush_interval
+            self.flush_threshold = flush_threshold
+
+            self.last_adjust_time = now
+            self.window_arrivals = 0
+            self.window_uploads = 0
+            self.window_errors = 0
+
+        log.debug('Adjusted flush parameters: %s', self.metrics())
+
+    def metrics(self):
+        return {
+            'flush_threshold': self.flush_threshold,
+            'flush_interval': self.flush_interval,
+            'arrival_rate': self.arrival_rate,
+            'error_rate': self.error_rate,
+            'upload_latency_p99': percentile(self.upload_latencies, 0.99),
+            'delivery_latency_p99': percentile(self.delivery_latencies, 0.99),
+        }
@@ -0,0 +1,140 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import collections
+import io
+import sys
+import threading
+import time
+
+from future import standard_library
+# noinspection PyUnresolvedReferences
+from future.builtins import *
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python < 3.4
+    tracemalloc = None
+
+standard_library.install_aliases()
+
+DEFAULT_PROFILE_DURATION = 30.0
+DEFAULT_SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 10
+REPORT_TOP = 30
+
+
+class StageTimings(object):
+    """Accumulated wall-clock time and item counts per processing stage, safe to update from several threads."""
+
+    STAGES = ('read', 'parse', 'enqueue', 'serialize', 'upload')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+
+    def add(self, stage, seconds, count=1):
+        with self.lock:
+            self.seconds[stage] += seconds
+            self.counts[stage] += count
+
+    def report_lines(self):
+        lines = ['%-10s %12s %10s %14s' % ('stage', 'seconds', 'count', 'usec/item')]
+        for stage in self.STAGES:
+            seconds = self.seconds.get(stage, 0.0)
+            count = self.counts.get(stage, 0)
+            per_item = seconds / count * 1e6 if count else 0.0
+            lines.append('%-10s %12.4f %10d %14.1f' % (stage, seconds, count, per_item))
+        return lines
+
+
+class Profiler(object):
+    """
+    Samples the stacks of all other threads every `interval` seconds and, when available, traces memory allocations
+    with tracemalloc. Nothing is sampled or traced before start() or after stop(), which writes the report to
+    `filename`.
+    """
+
+    def __init__(self, filename, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+        self.timings = StageTimings()
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self.start_time = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.started_tracemalloc = False
+
+    def start(self):
+        self.start_time = time.time()
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.started_tracemalloc = True
+
+        self.thread = threading.Thread(target=self._sample)
+        self.thread.name = 'profiler'
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+        snapshot = None
+        if self.started_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            traced_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            traced_memory = None
+
+        self._write_report(time.time() - self.start_time, snapshot, traced_memory)
+        return self.filename
+
+    def _sample(self):
+        own_ident = threading.current_thread().ident
+        while not self.stop_event.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self.samples[tuple(stack)] += 1
+            self.sample_count += 1
+
+    def _write_report(self, duration, snapshot, traced_memory):
+        own_time = collections.Counter()
+        total_time = collections.Counter()
+        for stack, count in self.samples.items():
+            own_time[_format_frame(stack[0])] += count
+            for function in {_format_frame(frame) for frame in stack}:
+                total_time[function] += count
+
+        lines = [
+            'Profile of %.1f seconds, %d samples every %.1f ms' % (duration, self.sample_count, self.interval * 1e3)
+        ]
+        lines += ['', 'Stage timings:'] + self.timings.report_lines()
+        lines += ['', 'Top functions by own samples:']
+        lines += ['%8d  %s' % (count, function) for function, count in own_time.most_common(REPORT_TOP)]
+        lines += ['', 'Top functions by total samples:']
+        lines += ['%8d  %s' % (count, function) for function, count in total_time.most_common(REPORT_TOP)]
+
+        lines += ['', 'Memory:']
+        if snapshot is None:
+            lines.append('tracemalloc is not available or was already tracing')
+        else:
+            lines.append('traced current: %d bytes, peak: %d bytes' % traced_memory)
+            lines += [str(stat) for stat in snapshot.statistics('lineno')[:REPORT_TOP]]
+
+        with io.open(self.filename, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def _format_frame(frame):
+    filename, lineno, name = frame
+    return '%s (%s:%s)' % (name, filename, lineno)
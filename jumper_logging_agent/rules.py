@@ -0,0 +1,203 @@
+"""
+Filter and field-projection rules applied to events right after they are parsed.
+
+A rule set is a list of rules, each a dict with an optional "match" and any of:
+    "action": "drop" discards the event, "keep" accepts it without evaluating the following rules
+    "project": list of fields to keep, all other fields are removed
+    "remove": list of fields to remove
+    "redact": list of fields whose values are replaced with REDACTED
+    "rename": dict mapping old field names to new ones
+The field operations of a matching rule are applied in the order above. "match" maps field names to a value (equality),
+a list of values (membership) or a dict of operators (see OPERATORS), all of which must hold. A rule without "match"
+applies to every event. For example:
+    [
+        {"match": {"priority": {"lt": 1}}, "action": "drop"},
+        {"match": {"type": ["sensor", "power"]}, "remove": ["raw"], "rename": {"ts": "timestamp"}}
+    ]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import operator
+
+from future import standard_library
+# noinspection PyUnresolvedReferences
+from future.builtins import *
+
+standard_library.install_aliases()
+
+REDACTED = '[REDACTED]'
+
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'in': lambda value, values: value in values,
+}
+
+ACTIONS = ('drop', 'keep')
+RULE_KEYS = ('match', 'action', 'project', 'remove', 'redact', 'rename')
+
+_MISSING = object()
+
+
+def compile_rules(rules):
+    """
+    Compiles a rule set into a function that takes an event and returns the transformed event, or None if it should
+    be dropped. Returns None for an empty rule set, so callers can skip filtering altogether.
+    Raises ValueError if the rule set is invalid.
+    """
+    if not rules:
+        return None
+
+    if not isinstance(rules, list):
+        raise ValueError('rules must be a list')
+
+    compiled = [_compile_rule(i, rule) for i, rule in enumerate(rules)]
+
+    def apply_rules(event):
+        for matches, drop, transform, final in compiled:
+            if matches is None or matches(event):
+                if drop:
+                    return None
+                if transform is not None:
+                    event = transform(event)
+                if final:
+                    return event
+        return event
+
+    return apply_rules
+
+
+def _compile_rule(index, rule):
+    if not isinstance(rule, dict):
+        raise ValueError('rule #%s must be an object' % (index,))
+
+    unknown_keys = set(rule) - set(RULE_KEYS)
+    if unknown_keys:
+        raise ValueError('rule #%s has unknown keys: %s' % (index, ', '.join(sorted(unknown_keys))))
+
+    action = rule.get('action')
+    if action is not None and action not in ACTIONS:
+        raise ValueError('rule #%s has unknown action %s' % (index, repr(action)))
+
+    matches = _compile_match(index, rule['match']) if 'match' in rule else None
+
+    transforms = []
+    if 'project' in rule:
+        transforms.append(_compile_project(_field_list(index, rule, 'project')))
+    if 'remove' in rule:
+        transforms.append(_compile_remove(_field_list(index, rule, 'remove')))
+    if 'redact' in rule:
+        transforms.append(_compile_redact(_field_list(index, rule, 'redact')))
+    if 'rename' in rule:
+        renames = rule['rename']
+        if not isinstance(renames, dict):
+            raise ValueError('rule #%s: rename must be an object' % (index,))
+        transforms.append(_compile_rename(list(renames.items())))
+
+    return matches, action == 'drop', _chain(transforms), action == 'keep'
+
+
+def _field_list(index, rule, key):
+    fields = rule[key]
+    if not isinstance(fields, list):
+        raise ValueError('rule #%s: %s must be a list of field names' % (index, key))
+    return fields
+
+
+def _compile_match(index, match):
+    if not isinstance(match, dict) or not match:
+        raise ValueError('rule #%s: match must be a non-empty object' % (index,))
+
+    conditions = [_compile_condition(index, field, condition) for field, condition in match.items()]
+    if len(conditions) == 1:
+        return conditions[0]
+
+    def matches(event):
+        for condition in conditions:
+            if not condition(event):
+                return False
+        return True
+
+    return matches
+
+
+def _compile_condition(index, field, condition):
+    if isinstance(condition, dict):
+        tests = []
+        for name, operand in condition.items():
+            if name not in OPERATORS:
+                raise ValueError('rule #%s: unknown operator %s' % (index, repr(name)))
+            tests.append((OPERATORS[name], operand))
+
+        def condition_matches(event):
+            value = event.get(field, _MISSING)
+            if value is _MISSING:
+                return False
+            try:
+                for op, operand in tests:
+                    if not op(value, operand):
+                        return False
+            except TypeError:
+                # Incomparable types, e.g. a string field compared with a number
+                return False
+            return True
+
+        return condition_matches
+
+    if isinstance(condition, list):
+        values = condition
+        return lambda event: event.get(field, _MISSING) in values
+
+    return lambda event: event.get(field, _MISSING) == condition
+
+
+def _compile_project(fields):
+    return lambda event: {field: event[field] for field in fields if field in event}
+
+
+def _compile_remove(fields):
+    def remove(event):
+        for field in fields:
+            event.pop(field, None)
+        return event
+
+    return remove
+
+
+def _compile_redact(fields):
+    def redact(event):
+        for field in fields:
+            if field in event:
+                event[field] = REDACTED
+        return event
+
+    return redact
+
+
+def _compile_rename(renames):
+    def rename(event):
+        for old, new in renames:
+            if old in event:
+                event[new] = event.pop(old)
+        return event
+
+    return rename
+
+
+def _chain(transforms):
+    if not transforms:
+        return None
+    if len(transforms) == 1:
+        return transforms[0]
+
+    def transform(event):
+        for t in transforms:
+            event = t(event)
+        return event
+
+    return transform
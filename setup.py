@@ -96,6 +96,7 @@ setup(
     entry_points={
         'console_scripts': [
             'agent=agent:main',
+            'jumper-logging-agent=jumper_logging_agent.agent:main',
         ],
     },
 )
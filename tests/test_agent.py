@@ -5,8 +5,10 @@ import functools
 import json
 import random
 import select
+import shutil
 import string
 import subprocess
+import tempfile
 import threading
 import time
 import unittest
@@ -19,7 +21,7 @@ from future.builtins import *
 
 from . import mock_event_store
 from .mock_event_store import MockEventStore
-from jumper_logging_agent.agent import Agent, is_fifo
+from jumper_logging_agent.agent import Agent, ConfigError, is_fifo, load_config, send_agent_command
 
 standard_library.install_aliases()
 
@@ -215,11 +217,15 @@ class AgentTestsInThread(_AbstractAgentTestCase):
 
     def start_agent(self, **kwargs):
         self.mock_event_store = MockEventStore()
-        listening_event = threading.Event()
         self.agent = Agent(
             input_filename=self.agent_filename, project_id='my_project_id', write_key='my_write_key',
-            event_store=self.mock_event_store, on_listening=lambda: listening_event.set(), **kwargs
+            event_store=self.mock_event_store, **kwargs
         )
+        self.run_agent()
+
+    def run_agent(self):
+        listening_event = threading.Event()
+        self.agent.on_listening = lambda: listening_event.set()
         self.thread = threading.Thread(target=self.agent.start)
         self.thread.daemon = True
         self.thread.name = 'Agent_thread'
@@ -262,6 +268,157 @@ class AgentTestsInThread(_AbstractAgentTestCase):
         time.sleep(0.1)
         self.assertEqual(mock_select.call_count, 2)
 
+    def test_rules(self):
+        self.start_agent(flush_interval=10, flush_threshold=2, rules=[
+            {'match': {'event_id': 1}, 'action': 'drop'},
+            {'remove': ['priority']},
+        ])
+        self.push_events_to_agent(event_ids=[1, 2, 3], priority=1)
+        wait_for(lambda: len(self.written_events('t')) == 2, 'events to be flushed')
+        self.assertEqual(self.agent.dropped_event_count, 1)
+        self.assertEqual(self.written_events(), [{'event_id': 2, 'type': 't'}, {'event_id': 3, 'type': 't'}])
+
+    def test_rules_dont_change_priority_flush(self):
+        self.start_agent(flush_interval=10, flush_threshold=10, flush_priority=2, rules=[
+            {'match': {'event_id': 1}, 'remove': ['priority']},
+            {'match': {'event_id': 2}, 'redact': ['priority']},
+        ])
+        self.push_events_to_agent(event_ids=[1], priority=2)
+        wait_for(lambda: len(self.written_events('t')) == 1, 'high priority event to be flushed')
+
+        self.push_events_to_agent(event_ids=[2], priority=0)
+        time.sleep(0.5)
+        self.assertEqual(len(self.written_events('t')), 1)
+
+    def test_profile(self):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        self.start_agent(flush_interval=10, flush_threshold=2, profile_dir=profile_dir)
+        send_agent_command(self.agent_filename, 'profile 0.5')
+        wait_for(lambda: self.agent.profiler, 'profiling to start')
+        self.push_events_to_agent(event_ids=[1, 2])
+        wait_for(lambda: os.listdir(profile_dir), 'profile to be written')
+
+        with open(os.path.join(profile_dir, os.listdir(profile_dir)[0])) as f:
+            profile = f.read()
+        self.assertIn('Stage timings', profile)
+        self.assertRegexpMatches(profile, r'parse +[0-9.]+ +2 ')
+        self.assertRegexpMatches(profile, r'upload +[0-9.]+ +2 ')
+        self.assertEqual(len(self.written_events()), 2)
+
+    def test_invalid_profile_duration(self):
+        agent = Agent(input_filename=self.agent_filename, project_id='my_project_id', write_key='my_write_key')
+        with patch('jumper_logging_agent.agent.log') as mock_log:
+            for duration in ('-5', '0', 'inf', 'nan', 'soon'):
+                self.assertTrue(agent.handle_control(('profile %s' % (duration,)).encode('utf-8')))
+        self.assertEqual(mock_log.warn.call_count, 5)
+        self.assertIsNone(agent.profiler)
+
+    def test_request_profile_toggle(self):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        self.start_agent(profile_dir=profile_dir)
+        self.agent.request_profile_toggle()
+        wait_for(lambda: self.agent.profiler, 'profiling to start')
+        self.agent.request_profile_toggle()
+        wait_for(lambda: os.listdir(profile_dir), 'profile to be written')
+        self.assertIsNone(self.agent.profiler)
+
+    def test_adaptive_flush(self):
+        self.start_agent(flush_interval=10, flush_threshold=10, adaptive_flush={
+            'max_flush_interval': 0.3, 'adjust_interval': 0.2
+        })
+        controller = self.agent.projects[0].flush_controller
+        self.assertEqual(controller.flush_interval, 0.3)
+        self.push_events_to_agent(event_ids=range(2))
+        wait_for(lambda: len(self.written_events('t')) == 2, 'events to be flushed', 2.0)
+        wait_for(lambda: controller.arrival_rate is not None, 'flush parameters to be adjusted')
+        self.assertIsNotNone(controller.metrics()['delivery_latency_p99'])
+
+        with patch('jumper_logging_agent.agent.log.info') as mock_info:
+            send_agent_command(self.agent_filename, 'metrics')
+            wait_for(
+                lambda: any(c[0][0].startswith('Flush metrics') for c in mock_info.call_args_list),
+                'flush metrics to be logged'
+            )
+        metrics = [c[0][2] for c in mock_info.call_args_list if c[0][0].startswith('Flush metrics')][0]
+        self.assertSetEqual(set(metrics), set(controller.metrics()))
+        self.assertIsNotNone(metrics['arrival_rate'])
+
+    def test_rules_with_multiple_projects(self):
+        self.agent = Agent(
+            input_filename=self.agent_filename, flush_interval=10, flush_threshold=1, projects=[
+                {'project_id': 'a', 'write_key': 'key_a'},
+                {'project_id': 'b', 'write_key': 'key_b'},
+            ], rules=[{'project': ['type', 'value']}]
+        )
+        event_stores = {}
+        for project in self.agent.projects:
+            project.event_store = event_stores[project.project_id] = MockEventStore()
+        self.run_agent()
+
+        self.thread_local_agent_file().write(
+            json.dumps({'type': 't', 'value': 1, 'extra': 2, 'project': 'b'}).encode() + b'\n'
+        )
+        self.thread_local_agent_file().flush()
+
+        wait_for(lambda: event_stores['b'].events, 'event to be flushed')
+        self.assertEqual(event_stores['b'].events, [{'type': 't', 'value': 1}])
+        self.assertFalse(event_stores['a'].events)
+
+    def test_route_without_default_project(self):
+        agent = Agent(input_filename=self.agent_filename, projects=[
+            {'project_id': 'a', 'write_key': 'key_a', 'input': self.agent_filename + '_a'},
+        ])
+        with patch('jumper_logging_agent.agent.log') as mock_log:
+            self.assertIsNone(agent.route({'event_id': 1}))
+        self.assertTrue(mock_log.warn.called)
+        self.assertIs(agent.route({'event_id': 1, 'project': 'a'}), agent.projects[0])
+
+    def test_route_from_project_input(self):
+        agent = Agent(input_filename=self.agent_filename, projects=[
+            {'project_id': 'a', 'write_key': 'key_a'},
+            {'project_id': 'b', 'write_key': 'key_b', 'input': self.agent_filename + '_b'},
+        ])
+        project_b = agent.projects_by_id['b']
+        event = {'event_id': 1, 'project': 'b'}
+        self.assertIs(agent.route(event, project_b), project_b)
+        self.assertEqual(event, {'event_id': 1})
+        with patch('jumper_logging_agent.agent.log') as mock_log:
+            self.assertIsNone(agent.route({'event_id': 2, 'project': 'a'}, project_b))
+        self.assertTrue(mock_log.warn.called)
+
+    def test_multiple_projects(self):
+        other_filename = self.agent_filename + '_other'
+        self.addCleanup(delete_file, other_filename)
+        self.agent = Agent(
+            input_filename=self.agent_filename, flush_interval=10, flush_threshold=1, projects=[
+                {'project_id': 'a', 'write_key': 'key_a'},
+                {'project_id': 'b', 'write_key': 'key_b'},
+                {'project_id': 'c', 'write_key': 'key_c', 'input': other_filename},
+            ]
+        )
+        event_stores = {}
+        for project in self.agent.projects:
+            project.event_store = event_stores[project.project_id] = MockEventStore()
+        self.run_agent()
+
+        self.push_events_to_agent(event_ids=[1])
+        self.thread_local_agent_file().write(json.dumps({'event_id': 2, 'project': 'b'}).encode() + b'\n')
+        self.thread_local_agent_file().flush()
+        other_file = open_fifo_readwrite(other_filename)
+        self.addCleanup(other_file.close)
+        other_file.write(json.dumps({'event_id': 3}).encode() + b'\n')
+        other_file.write(json.dumps({'event_id': 4, 'project': 'c'}).encode() + b'\n')
+        other_file.flush()
+
+        wait_for(lambda: self.agent.event_count == 4, 'events to reach agent')
+        wait_for(lambda: len(event_stores['c'].events) == 2 and all(s.events for s in event_stores.values()),
+                 'events to be flushed')
+        self.assertEqual(event_stores['a'].events, [{'event_id': 1, 'type': 't'}])
+        self.assertEqual(event_stores['b'].events, [{'event_id': 2}])
+        self.assertEqual(event_stores['c'].events, [{'event_id': 3}, {'event_id': 4}])
+
 
 class AgentProcessTests(_AbstractAgentTestCase):
     def setUp(self):
@@ -318,5 +475,29 @@ class AgentProcessTests(_AbstractAgentTestCase):
         return [e for e in events if e['type'] == t] if t is not None else events
 
 
+
+class LoadConfigTests(unittest.TestCase):
+    def load(self, config):
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        self.addCleanup(os.remove, filename)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(config).encode('utf-8'))
+        return load_config(filename)
+
+    def test_single_project(self):
+        config = self.load({'project_id': 'a', 'write_key': 'key_a'})
+        self.assertEqual(config['projects'], [{'project_id': 'a', 'write_key': 'key_a'}])
+
+    def test_invalid_projects(self):
+        with self.assertRaises(ConfigError) as cm:
+            self.load([{'project_id': 'a', 'write_key': 'key_a'}])
+        self.assertEqual(cm.exception.return_code, 4)
+
+        for projects in ([], {'project_id': 'a', 'write_key': 'key_a'}, ['a'], [{'project_id': 'a'}]):
+            with self.assertRaises(ConfigError) as cm:
+                self.load({'projects': projects})
+            self.assertEqual(cm.exception.return_code, 5)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,170 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gzip
+import json
+import os
+import time
+import unittest
+
+import requests
+from future import standard_library
+
+from future.builtins import *
+
+from .mock_event_store import MockEventStore
+from .test_agent import DEFAULT_CONFIG_FILE, delete_file, random_string
+from jumper_logging_agent.backfill import Backfill, Checkpoint, main, read_batches
+
+standard_library.install_aliases()
+
+
+class FailingEventStore(MockEventStore):
+    def __init__(self, fail_event_id):
+        super(FailingEventStore, self).__init__()
+        self.fail_event_id = fail_event_id
+
+    def add_events(self, events):
+        if any(e['event_id'] == self.fail_event_id for e in events):
+            raise IOError('upload failed')
+        super(FailingEventStore, self).add_events(events)
+
+
+class RejectingEventStore(MockEventStore):
+    """Answers batches containing reject_event_id with an HTTP error, status_code 400 by default."""
+
+    def __init__(self, reject_event_id, status_code=400, headers=None, times=None):
+        super(RejectingEventStore, self).__init__()
+        self.reject_event_id = reject_event_id
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.times = times
+        self.attempts = []
+
+    def add_events(self, events):
+        if any(e['event_id'] == self.reject_event_id for e in events):
+            self.attempts.append(time.time())
+            if self.times is None or len(self.attempts) <= self.times:
+                response = requests.Response()
+                response.status_code = self.status_code
+                response.headers.update(self.headers)
+                raise requests.HTTPError('%s error' % (self.status_code,), response=response)
+        super(RejectingEventStore, self).add_events(events)
+
+
+def write_events_file(filename, event_ids, compress=False):
+    opener = gzip.open if compress else open
+    with opener(filename, 'wb') as f:
+        for event_id in event_ids:
+            f.write(json.dumps({'event_id': event_id, 'type': 't'}).encode() + b'\n')
+
+
+class BackfillTests(unittest.TestCase):
+    def setUp(self):
+        self.run_id = random_string()
+        self.events_filename = '/tmp/backfill_events_' + self.run_id
+        self.checkpoint_filename = '/tmp/backfill_checkpoint_' + self.run_id
+        self.quarantine_filename = '/tmp/backfill_quarantine_' + self.run_id
+
+    def tearDown(self):
+        for filename in (
+                self.events_filename, self.events_filename + '.gz', self.checkpoint_filename, self.quarantine_filename
+        ):
+            delete_file(filename)
+
+    def test_read_batches(self):
+        write_events_file(self.events_filename, range(25))
+        batches = list(read_batches(self.events_filename, batch_size=10))
+        self.assertEqual([len(events) for events, _ in batches], [10, 10, 5])
+        self.assertEqual(batches[-1][1], os.path.getsize(self.events_filename))
+
+    def test_read_batches_from_offset(self):
+        write_events_file(self.events_filename, range(25))
+        _, offset = next(read_batches(self.events_filename, batch_size=10))
+        events = [e for batch, _ in read_batches(self.events_filename, offset) for e in batch]
+        self.assertEqual([e['event_id'] for e in events], list(range(10, 25)))
+
+    def test_read_batches_gzip(self):
+        write_events_file(self.events_filename + '.gz', range(5), compress=True)
+        events = [e for batch, _ in read_batches(self.events_filename + '.gz') for e in batch]
+        self.assertEqual(len(events), 5)
+
+    def test_backfill_uploads_all_events(self):
+        write_events_file(self.events_filename, range(1000))
+        event_store = MockEventStore()
+        backfill = Backfill(event_store, Checkpoint(self.checkpoint_filename), workers=3, batch_size=7)
+        self.assertTrue(backfill.run([self.events_filename]))
+        self.assertSetEqual({e['event_id'] for e in event_store.events}, set(range(1000)))
+
+    def test_backfill_resumes_from_checkpoint(self):
+        write_events_file(self.events_filename, range(100))
+        failing_event_store = FailingEventStore(fail_event_id=55)
+        backfill = Backfill(
+            failing_event_store, Checkpoint(self.checkpoint_filename), workers=1, batch_size=10, max_retries=0
+        )
+        self.assertFalse(backfill.run([self.events_filename]))
+
+        event_store = MockEventStore()
+        backfill = Backfill(event_store, Checkpoint(self.checkpoint_filename), batch_size=10)
+        self.assertTrue(backfill.run([self.events_filename]))
+        self.assertEqual(sorted(e['event_id'] for e in event_store.events), list(range(50, 100)))
+
+        event_store = MockEventStore()
+        backfill = Backfill(event_store, Checkpoint(self.checkpoint_filename), batch_size=10)
+        self.assertTrue(backfill.run([self.events_filename]))
+        self.assertFalse(event_store.events)
+
+    def test_rejected_batch_is_not_retried(self):
+        write_events_file(self.events_filename, range(30))
+        event_store = RejectingEventStore(reject_event_id=15)
+        backfill = Backfill(event_store, Checkpoint(self.checkpoint_filename), workers=1, batch_size=10, retry_delay=10)
+        self.assertFalse(backfill.run([self.events_filename]))
+        self.assertEqual(len(event_store.attempts), 1)
+        self.assertEqual(Checkpoint(self.checkpoint_filename).offset(os.path.abspath(self.events_filename)),
+                         next(read_batches(self.events_filename, batch_size=10))[1])
+
+    def test_rejected_batch_is_quarantined(self):
+        write_events_file(self.events_filename, range(30))
+        event_store = RejectingEventStore(reject_event_id=15)
+        backfill = Backfill(
+            event_store, Checkpoint(self.checkpoint_filename), workers=2, batch_size=10,
+            quarantine_filename=self.quarantine_filename
+        )
+        self.assertTrue(backfill.run([self.events_filename]))
+        self.assertEqual(sorted(e['event_id'] for e in event_store.events), list(range(10)) + list(range(20, 30)))
+        with open(self.quarantine_filename, 'rb') as f:
+            quarantined = [json.loads(line.decode('utf-8'))['event_id'] for line in f]
+        self.assertEqual(quarantined, list(range(10, 20)))
+        self.assertEqual(backfill.quarantined_event_count, 10)
+
+    def test_throttled_batch_honors_retry_after(self):
+        write_events_file(self.events_filename, range(10))
+        event_store = RejectingEventStore(reject_event_id=5, status_code=429, headers={'Retry-After': '0.3'}, times=1)
+        backfill = Backfill(event_store, Checkpoint(self.checkpoint_filename), retry_delay=0)
+        self.assertTrue(backfill.run([self.events_filename]))
+        self.assertEqual(len(event_store.events), 10)
+        started = event_store.attempts[0]
+        self.assertGreaterEqual(event_store.attempts[1] - started, 0.3)
+
+    def test_backfill_continues_after_missing_file(self):
+        write_events_file(self.events_filename, range(10))
+        event_store = MockEventStore()
+        backfill = Backfill(event_store, Checkpoint(self.checkpoint_filename))
+        self.assertFalse(backfill.run(['/tmp/backfill_missing_' + self.run_id, self.events_filename]))
+        self.assertEqual(len(event_store.events), 10)
+
+    def test_backfill_with_unwritable_checkpoint(self):
+        write_events_file(self.events_filename, range(50))
+        # A regular file can't be used as the checkpoint's directory
+        unwritable_checkpoint = os.path.join(self.events_filename, 'checkpoint.json')
+        backfill = Backfill(MockEventStore(), Checkpoint(unwritable_checkpoint), workers=1, batch_size=1)
+        self.assertFalse(backfill.run([self.events_filename]))
+
+        return_code = main([
+            '--config-file', DEFAULT_CONFIG_FILE, '--event-store', 'tests.mock_event_store.MockEventStore',
+            '--checkpoint-file', unwritable_checkpoint, self.events_filename
+        ])
+        self.assertNotEqual(return_code, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
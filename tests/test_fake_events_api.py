@@ -0,0 +1,98 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+import threading
+import unittest
+
+import requests
+from future import standard_library
+
+from future.builtins import *
+
+from jumper_logging_agent.agent import DefaultEventStore
+from jumper_logging_agent.fake_events_api import FakeEventsAPI, parse_latency
+
+standard_library.install_aliases()
+
+
+class FakeEventsAPITests(unittest.TestCase):
+    def start_server(self, **kwargs):
+        server = FakeEventsAPI(('127.0.0.1', 0), seed=1, **kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def event_store(self, server, write_key='my_write_key'):
+        return DefaultEventStore('my_project_id', write_key, base_url=server.base_url, timeout=5.0)
+
+    def test_add_events(self):
+        server = self.start_server()
+        event_store = self.event_store(server)
+        event_store.add_events([{'event_id': 1, 'type': 't'}, {'event_id': 2, 'type': 't'}])
+        event_store.add_events([{'event_id': 3, 'type': 't'}])
+
+        stats = server.stats()
+        self.assertEqual(stats['events'], {'my_project_id': 3})
+        self.assertEqual(stats['responses'], {'200': 2})
+
+    def test_concurrent_requests(self):
+        server = self.start_server()
+        errors = []
+
+        def post(event_id):
+            try:
+                self.event_store(server).add_events([{'event_id': event_id}])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(200)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(server.stats()['responses'], {'200': 200})
+
+    def test_missing_write_key(self):
+        server = self.start_server()
+        with self.assertRaises(requests.HTTPError) as cm:
+            self.event_store(server, write_key='').add_events([{'event_id': 1}])
+        self.assertEqual(cm.exception.response.status_code, 401)
+
+    def test_error_responses(self):
+        for rate, status_code in (('throttle_rate', 429), ('unavailable_rate', 503), ('error_rate', 500)):
+            server = self.start_server(**{rate: 1.0})
+            with self.assertRaises(requests.HTTPError) as cm:
+                self.event_store(server).add_events([{'event_id': 1}])
+            self.assertEqual(cm.exception.response.status_code, status_code)
+            self.assertEqual(server.stats()['total_events'], 0)
+
+    def test_connection_reset(self):
+        server = self.start_server(reset_rate=1.0)
+        with self.assertRaises(requests.ConnectionError):
+            self.event_store(server).add_events([{'event_id': 1}])
+
+    def test_timeout(self):
+        server = self.start_server(latency='1.0')
+        event_store = DefaultEventStore('my_project_id', 'my_write_key', base_url=server.base_url, timeout=0.1)
+        with self.assertRaises(requests.Timeout):
+            event_store.add_events([{'event_id': 1}])
+
+    def test_parse_latency(self):
+        rng = random.Random(1)
+        self.assertEqual(parse_latency(None)(rng), 0.0)
+        self.assertEqual(parse_latency('0.25')(rng), 0.25)
+        self.assertTrue(0.1 <= parse_latency('uniform:0.1,0.2')(rng) <= 0.2)
+        self.assertGreaterEqual(parse_latency('normal:0,1')(rng), 0.0)
+        for spec in ('fast', 'uniform:1', 'exp:a', 'gamma:1,2', '-1', 'exp:0', 'uniform:0.2,0.1', 'normal:1,-1'):
+            with self.assertRaises(ValueError):
+                parse_latency(spec)
+
+    def test_invalid_rates(self):
+        for kwargs in ({'error_rate': -0.1}, {'reset_rate': 1.5}, {'throttle_rate': 0.6, 'error_rate': 0.6}):
+            with self.assertRaises(ValueError):
+                FakeEventsAPI(('127.0.0.1', 0), **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
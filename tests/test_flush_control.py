@@ -0,0 +1,103 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import unittest
+
+from future import standard_library
+
+from future.builtins import *
+
+from jumper_logging_agent.flush_control import AdaptiveFlushController
+
+standard_library.install_aliases()
+
+
+class AdaptiveFlushControllerTests(unittest.TestCase):
+    def controller(self, **kwargs):
+        kwargs.setdefault('latency_slo', 10.0)
+        controller = AdaptiveFlushController(**kwargs)
+        controller.last_adjust_time = 0.0
+        return controller
+
+    def run_window(self, controller, now, rate, upload_seconds=0.1, delivery_latency=1.0, ok=True, uploads=10):
+        controller.record_arrival(int(rate * controller.adjust_interval))
+        for _ in range(uploads):
+            controller.record_flush(int(rate * controller.adjust_interval / uploads), upload_seconds,
+                                    delivery_latency if ok else None, ok)
+        controller.adjust(now)
+
+    def test_batch_size_follows_arrival_rate(self):
+        controller = self.controller(max_flush_threshold=10000)
+        self.run_window(controller, 5.0, rate=100)
+        # 100 events/s lingering for 80% of the SLO minus the upload latency
+        self.assertAlmostEqual(controller.flush_interval, 7.9)
+        self.assertEqual(controller.flush_threshold, 790)
+
+        self.run_window(controller, 10.0, rate=1000)
+        self.assertEqual(controller.flush_threshold, int(round(550 * 7.9)))
+
+    def test_bounds(self):
+        controller = self.controller(min_flush_threshold=50, max_flush_threshold=200, max_flush_interval=2.0)
+        self.run_window(controller, 5.0, rate=1000)
+        self.assertEqual(controller.flush_interval, 2.0)
+        self.assertEqual(controller.flush_threshold, 200)
+
+        controller = self.controller(min_flush_threshold=50, max_flush_threshold=200, max_flush_interval=2.0)
+        self.run_window(controller, 5.0, rate=1)
+        self.assertEqual(controller.flush_threshold, 50)
+
+    def test_missed_slo_tightens_interval(self):
+        controller = self.controller()
+        self.run_window(controller, 5.0, rate=10, delivery_latency=20.0)
+        self.assertLess(controller.flush_interval, 7.9)
+        self.assertGreaterEqual(controller.flush_interval, controller.min_flush_interval)
+
+    def test_arrival_rate_ignores_flushes(self):
+        controller = self.controller(max_flush_threshold=10000)
+        self.run_window(controller, 5.0, rate=100)
+        # Nothing flushed in a window (events still pending) doesn't mean nothing arrived
+        controller.record_arrival(500)
+        controller.adjust(10.0)
+        self.assertEqual(controller.arrival_rate, 100.0)
+        self.assertEqual(controller.flush_threshold, 790)
+
+    def test_errors_dont_lengthen_interval(self):
+        controller = self.controller(max_flush_interval=100.0)
+        self.run_window(controller, 5.0, rate=10, ok=False)
+        self.assertEqual(controller.error_rate, 1.0)
+        # No upload succeeded, so the interval stays at its initial 80% of the SLO
+        self.assertAlmostEqual(controller.flush_interval, 8.0)
+
+        self.run_window(controller, 10.0, rate=10)
+        self.assertEqual(controller.error_rate, 0.0)
+        self.assertAlmostEqual(controller.flush_interval, 7.9)
+
+    def test_failing_slow_uploads_keep_batch_size(self):
+        controller = self.controller(max_flush_threshold=10000)
+        self.run_window(controller, 5.0, rate=100)
+        self.assertEqual(controller.flush_threshold, 790)
+
+        # Uploads timing out after 30 seconds mustn't shrink batches into many more requests to the failing backend
+        self.run_window(controller, 10.0, rate=100, upload_seconds=30.0, ok=False)
+        self.run_window(controller, 15.0, rate=100, upload_seconds=30.0, ok=False)
+        self.assertEqual(controller.error_rate, 1.0)
+        self.assertAlmostEqual(controller.flush_interval, 7.9)
+        self.assertEqual(controller.flush_threshold, 790)
+        self.assertEqual(controller.metrics()['upload_latency_p99'], 0.1)
+
+    def test_metrics(self):
+        controller = self.controller()
+        self.run_window(controller, 5.0, rate=10, upload_seconds=0.5, delivery_latency=3.0)
+        metrics = controller.metrics()
+        self.assertEqual(metrics['flush_threshold'], controller.flush_threshold)
+        self.assertEqual(metrics['flush_interval'], controller.flush_interval)
+        self.assertEqual(metrics['arrival_rate'], 10.0)
+        self.assertEqual(metrics['upload_latency_p99'], 0.5)
+        self.assertEqual(metrics['delivery_latency_p99'], 3.0)
+
+    def test_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            AdaptiveFlushController(min_flush_threshold=10, max_flush_threshold=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import unittest
+
+from future import standard_library
+
+from future.builtins import *
+
+from jumper_logging_agent.rules import REDACTED, compile_rules
+
+standard_library.install_aliases()
+
+
+class RulesTests(unittest.TestCase):
+    def test_no_rules(self):
+        self.assertIsNone(compile_rules(None))
+        self.assertIsNone(compile_rules([]))
+
+    def test_drop(self):
+        filter_event = compile_rules([
+            {'match': {'type': 'debug'}, 'action': 'drop'},
+            {'match': {'priority': {'lt': 1}}, 'action': 'drop'},
+        ])
+        self.assertIsNone(filter_event({'type': 'debug'}))
+        self.assertIsNone(filter_event({'type': 't', 'priority': 0}))
+        self.assertEqual(filter_event({'type': 't', 'priority': 1}), {'type': 't', 'priority': 1})
+        self.assertEqual(filter_event({'type': 't', 'priority': 'high'}), {'type': 't', 'priority': 'high'})
+        self.assertEqual(filter_event({'type': 't'}), {'type': 't'})
+
+    def test_keep_stops_evaluation(self):
+        filter_event = compile_rules([
+            {'match': {'type': ['alert', 'error']}, 'action': 'keep'},
+            {'action': 'drop'},
+        ])
+        self.assertEqual(filter_event({'type': 'alert'}), {'type': 'alert'})
+        self.assertIsNone(filter_event({'type': 'info'}))
+
+    def test_field_operations(self):
+        filter_event = compile_rules([
+            {'match': {'type': 'sensor'}, 'project': ['type', 'ts', 'value', 'password']},
+            {'remove': ['raw'], 'redact': ['password'], 'rename': {'ts': 'timestamp'}},
+        ])
+        self.assertEqual(
+            filter_event({'type': 'sensor', 'ts': 1, 'value': 2, 'password': 'x', 'extra': 3}),
+            {'type': 'sensor', 'timestamp': 1, 'value': 2, 'password': REDACTED}
+        )
+        self.assertEqual(filter_event({'type': 'other', 'raw': 'abc', 'extra': 3}), {'type': 'other', 'extra': 3})
+
+    def test_invalid_rules(self):
+        for rules in (
+                {'action': 'drop'},
+                [{'action': 'delete'}],
+                [{'match': {'priority': {'between': 1}}}],
+                [{'match': {}, 'action': 'drop'}],
+                [{'remove': 'raw'}],
+                [{'unknown': 1}],
+        ):
+            with self.assertRaises(ValueError):
+                compile_rules(rules)
+
+
+if __name__ == '__main__':
+    unittest.main()